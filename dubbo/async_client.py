@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import asyncio
+import logging
+import time
+
+from aiozk import ZKClient
+from aiozk.exc import NoNode, NodeExists
+
+from dubbo.client import BaseZkRegister
+from dubbo.common.constants import DUBBO_ZK_INTERFACE, DUBBO_ZK_PROVIDERS, DUBBO_ZK_CONFIGURATORS
+from dubbo.common.exceptions import RegisterException
+from dubbo.connection.connections import async_connection_pool
+
+logger = logging.getLogger('python-dubbo')
+
+
+class AsyncDubboClient(object):
+    """
+    基于asyncio实现dubbo调用的客户端，每个进行中的调用只占用一个task而不是一个线程
+    """
+
+    def __init__(self, interface, version=None, dubbo_version='2.6.1', group=None, zk_register=None, host=None):
+        """
+        :param interface: 接口名，例如：com.qianmi.pc.es.api.EsProductQueryProvider
+        :param version: 接口的版本号
+        :param dubbo_version: dubbo的版本号，默认为2.6.1
+        :param zk_register: zookeeper注册中心管理端，参见类：AsyncZkRegister
+        :param host: 远程主机地址，用于绕过zookeeper进行直连，例如：172.21.4.98:20882
+        """
+        if not zk_register and not host:
+            raise RegisterException('zk_register和host至少需要填入一个')
+
+        logger.debug('Created async client, interface=%s, version=%s', interface, version)
+
+        self.__interface = interface
+        self.__version = version
+        self.__dubbo_version = dubbo_version
+        self.__group = group
+        self.__zk_register = zk_register
+        self.__host = host
+
+    async def call(self, method, args=(), timeout=None):
+        """
+        执行远程调用，参数的使用方式与DubboClient.call一致
+        :param method: 远程调用的方法名
+        :param args: 方法参数
+        :param timeout: 请求超时时间（秒），不设置则不会超时
+        :return:
+        """
+        if not isinstance(args, (list, tuple)):
+            args = [args]
+
+        if self.__zk_register:  # 优先从zk中获取provider的host
+            host = await self.__zk_register.get_provider_host(self.__interface, self.__group, self.__version)
+        else:
+            host = self.__host
+
+        request_param = {
+            'dubbo_version': self.__dubbo_version,
+            'path': self.__interface,
+            'method': method,
+            'arguments': args,
+        }
+
+        if self.__group:
+            request_param['group'] = self.__group
+
+        if self.__version:
+            request_param['version'] = self.__version
+
+        logger.debug('Start request, host=%s, params=%s', host, request_param)
+        start_time = time.perf_counter()
+        result = await async_connection_pool.aget(host, request_param, timeout)
+        cost_time = int((time.perf_counter() - start_time) * 1000)
+        logger.debug('Request invoked, host=%s, params=%s, result=%s, cost=%sms, timeout=%ss',
+                     host, request_param, result, cost_time, timeout)
+        return result
+
+
+class AsyncZkRegister(BaseZkRegister):
+    """
+    基于aiozk的注册中心，功能与ZkRegister一致，使用前需要先调用start
+    """
+
+    def __init__(self, hosts, application_name='kiki_manager'):
+        """
+        :param hosts: Zookeeper的地址
+        :param application_name: 当前客户端的名称
+        """
+        BaseZkRegister.__init__(self, application_name)
+        self.zk = ZKClient(hosts)
+        # 每个interface一把锁，不同interface的首次解析可以并行进行
+        self._interface_locks = {}
+        # 已经安装了监听的interface，避免首次解析失败重试时重复添加监听
+        self._watched_interfaces = set()
+        self._watcher = self.zk.recipes.ChildrenWatcher()
+        # 已经注册的监听：(path, callback)，关闭时需要逐个移除
+        self._watches = []
+
+    async def start(self):
+        await self.zk.start()
+
+    async def get_provider_host(self, interface, consumer_group, consumer_version):
+        """
+        从zk中可以根据接口名称获取到此接口某个provider的host
+        :param interface:
+        :param consumer_group: 消费者group
+        :param consumer_version: 消费者version
+        :return:
+        """
+        if interface not in self.hosts:
+            async with self._interface_lock(interface):
+                if interface not in self.hosts:
+                    # 先安装监听再读取节点，即使读取失败监听也已经存在
+                    if interface not in self._watched_interfaces:
+                        self._watch(interface, consumer_group, consumer_version)
+                    await self._get_providers_from_zk(interface, consumer_group, consumer_version)
+                    await self._get_configurators_from_zk(interface)
+        return self._routing_with_wight(interface)
+
+    def _interface_lock(self, interface):
+        """
+        获取某个interface对应的锁
+        :param interface:
+        :return:
+        """
+        return self._interface_locks.setdefault(interface, asyncio.Lock())
+
+    async def _get_providers_from_zk(self, interface, consumer_group, consumer_version):
+        """
+        从zk中根据interface获取到providers信息
+        :param interface:
+        :return:
+        """
+        try:
+            children = await self.zk.get_children(DUBBO_ZK_PROVIDERS.format(interface))
+        except NoNode:
+            raise RegisterException('No providers for interface {0}'.format(interface))
+        providers = self._parse_providers(children, consumer_group, consumer_version)
+        if not providers:
+            raise RegisterException('no providers for interface {}'.format(interface))
+        await self._register_consumer(providers)
+        self._set_providers(interface, providers)
+
+    async def _get_configurators_from_zk(self, interface):
+        """
+        试图从配置中取出权重相关的信息
+        :param interface:
+        :return:
+        """
+        try:
+            children = await self.zk.get_children(DUBBO_ZK_CONFIGURATORS.format(interface))
+        except NoNode:
+            children = []
+        self._set_configurators(interface, children)
+
+    def _watch(self, interface, consumer_group, consumer_version):
+        """
+        监听/dubbo/{interface}下的分类节点，并对其中的providers以及configurators的子节点进行监听；
+        aiozk的监听循环在节点不存在时会直接结束，因此分类节点重新出现时需要重新添加监听，
+        这样后来才创建的configurators（例如通过dubbo-admin设置权重）也能被监听到
+        :param interface:
+        :param consumer_group:
+        :param consumer_version:
+        :return:
+        """
+        handlers = {
+            'providers': lambda children: self._set_providers(
+                interface, self._parse_providers(children, consumer_group, consumer_version)),
+            'configurators': lambda children: self._set_configurators(interface, children),
+        }
+        interface_path = DUBBO_ZK_INTERFACE.format(interface)
+
+        def _watch_children(category):
+            async def _on_children(children):
+                # 等待进行中的首次解析完成，首次解析尚未成功时忽略变化，下次调用时会重新读取
+                async with self._interface_lock(interface):
+                    if interface in self.hosts:
+                        # 节点不存在时aiozk回调的参数是NoNode类本身
+                        handlers[category]([] if children is NoNode else children)
+
+            return _on_children
+
+        callbacks = {category: _watch_children(category) for category in handlers}
+
+        async def _watch_categories(categories):
+            if categories is NoNode:
+                # interface节点不存在，移除监听，下次解析时重新添加
+                self._remove_watch(interface_path, _watch_categories)
+                self._watched_interfaces.discard(interface)
+                return
+            for category, callback in callbacks.items():
+                path = '{0}/{1}'.format(interface_path, category)
+                if category in categories:
+                    loop = self._watcher.loops.get(path)
+                    if loop is None or loop.done():
+                        self._remove_watch(path, callback)
+                        self._add_watch(path, callback)
+                else:
+                    await callback(NoNode)
+
+        self._watched_interfaces.add(interface)
+        self._add_watch(interface_path, _watch_categories)
+
+    def _add_watch(self, path, callback):
+        self._watcher.add_callback(path, callback)
+        self._watches.append((path, callback))
+
+    def _remove_watch(self, path, callback):
+        if (path, callback) in self._watches:
+            self._watches.remove((path, callback))
+            self._watcher.remove_callback(path, callback)
+
+    async def _register_consumer(self, providers):
+        """
+        把本机注册到对应的interface的consumer上去
+        :param providers:
+        :return:
+        """
+        consumer_path, consumer = self._consumer_node(providers)
+        await self.zk.ensure_path(consumer_path)
+        try:
+            await self.zk.create(consumer_path + '/' + consumer, ephemeral=True)
+        except NodeExists:
+            logger.debug('Consumer %s already exists.', consumer)
+
+    async def close(self):
+        """
+        先停止所有的监听，再关闭zookeeper客户端，避免监听在已关闭的客户端上继续等待
+        :return:
+        """
+        loops = list(self._watcher.loops.values())
+        for path, callback in list(self._watches):
+            self._remove_watch(path, callback)
+        await asyncio.gather(*loops, return_exceptions=True)
+        await self.zk.close()
+
+
+if __name__ == '__main__':
+    pass
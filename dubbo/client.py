@@ -18,17 +18,21 @@
  */
 """
 
+import itertools
 import logging
 import threading
 import time
 import random
+from bisect import bisect_right
 from typing import Optional
 from urllib.parse import quote
 
 from kazoo.client import KazooClient
+from kazoo.exceptions import NoNodeError
 from kazoo.protocol.states import KazooState
 
-from dubbo.common.constants import DUBBO_ZK_PROVIDERS, DUBBO_ZK_CONFIGURATORS, DUBBO_ZK_CONSUMERS
+from dubbo.common.constants import DUBBO_ZK_INTERFACE, DUBBO_ZK_PROVIDERS, DUBBO_ZK_CONFIGURATORS, \
+    DUBBO_ZK_CONSUMERS
 from dubbo.common.exceptions import RegisterException
 from dubbo.common.util import parse_url, get_pid, get_ip
 from dubbo.connection.connections import connection_pool
@@ -41,18 +45,20 @@ class DubboClient(object):
     用于实现dubbo调用的客户端
     """
 
-    def __init__(self, interface, version=None, dubbo_version='2.6.1',group=None,zk_register=None, host=None):
+    def __init__(self, interface, version=None, dubbo_version='2.6.1',group=None,zk_register=None, host=None,
+                 connections=1):
         """
         :param interface: 接口名，例如：com.qianmi.pc.es.api.EsProductQueryProvider
         :param version: 接口的版本号，例如：1.0.0，默认为1.0.0
         :param dubbo_version: dubbo的版本号，默认为2.4.10
         :param zk_register: zookeeper注册中心管理端，参见类：ZkRegister
         :param host: 远程主机地址，用于绕过zookeeper进行直连，例如：172.21.4.98:20882
+        :param connections: 与每个远程主机之间最多建立的连接数，默认为1，同一host的连接在所有client之间共享
         """
         if not zk_register and not host:
             raise RegisterException('zk_register和host至少需要填入一个')
 
-        logger.debug('Created client, interface={}, version={}'.format(interface, version))
+        logger.debug('Created client, interface=%s, version=%s', interface, version)
 
         self.__interface = interface
         self.__version = version
@@ -60,6 +66,7 @@ class DubboClient(object):
         self.__group=group
         self.__zk_register = zk_register
         self.__host = host
+        self.__connections = connections
 
     def call(self, method, args=(), timeout=None):
         """
@@ -87,7 +94,7 @@ class DubboClient(object):
             host = self.__zk_register.get_provider_host(self.__interface, self.__group, self.__version)
         else:
             host = self.__host
-        # logger.debug('get host {}'.format(host))
+        # logger.debug('get host %s', host)
 
         request_param = {
             'dubbo_version': self.__dubbo_version,
@@ -102,123 +109,86 @@ class DubboClient(object):
         if self.__version:
             request_param['version'] = self.__version
 
-        logger.debug('Start request, host={}, params={}'.format(host, request_param))
-        start_time = time.time()
-        result = connection_pool.get(host, request_param, timeout)
-        cost_time = int((time.time() - start_time) * 1000)
-        logger.debug('Finish request, host={}, params={}'.format(host, request_param))
-        logger.debug('Request invoked, host={}, params={}, result={}, cost={}ms, timeout={}s'.format(
-            host, request_param, result, cost_time, timeout))
+        logger.debug('Start request, host=%s, params=%s', host, request_param)
+        start_time = time.perf_counter()
+        result = connection_pool.get(host, request_param, timeout, connections=self.__connections)
+        cost_time = int((time.perf_counter() - start_time) * 1000)
+        logger.debug('Finish request, host=%s, params=%s', host, request_param)
+        logger.debug('Request invoked, host=%s, params=%s, result=%s, cost=%sms, timeout=%ss',
+                     host, request_param, result, cost_time, timeout)
         return result
 
 
-class ZkRegister(object):
+class BaseZkRegister(object):
     """
-    ZkRegister的主要作用：
-    1. 根据特定的interface从zk中取出与之相关的所有provider的host并且监听
-       provider的变化，当发生变化时更新最新的hosts到本地缓存；
-    2. 当从zk中获取指定的interface的provider的时候，把当前进程作为此interface
-       的一个consumer注册到zk中，并设置此节点的状态为ephemeral；
+    与具体的zookeeper客户端无关的注册中心逻辑：
+    1. 解析providers以及configurators节点，维护本地缓存的hosts以及权重；
+    2. 生成当前进程作为consumer注册到zk中的节点；
+    3. 根据权重选择provider的host；
     """
 
-    def __init__(self, hosts, application_name='kiki_manager'):
+    def __init__(self, application_name='kiki_manager'):
         """
-        :param hosts: Zookeeper的地址
         :param application_name: 当前客户端的名称
         """
-        zk = KazooClient(hosts=hosts)
-        # 对zookeeper连接状态的监控
-        zk.add_listener(self.state_listener)
-        zk.start()
-
-        self.zk = zk
         self.hosts = {}
         self.weights = {}
+        # interface -> (hosts, 累加的权重, 总权重)，hosts或weights变化时重新计算
+        self._cum_weights = {}
         self.application_name = application_name
-        self.lock = threading.Lock()
+        # 进程号和本机IP在注册consumer时不会改变，只获取一次
+        self._pid = get_pid()
+        self._ip = get_ip()
 
-    @staticmethod
-    def state_listener(state):
-        logger.debug('Current state -> {}'.format(state))
-        if state == KazooState.LOST:
-            logger.debug('The session to register has lost.')
-        elif state == KazooState.SUSPENDED:
-            logger.debug('Disconnected from zookeeper.')
-        else:
-            logger.debug('Connected or disconnected to zookeeper.')
-
-    def get_provider_host(self, interface, consumer_group, consumer_version):
+    def _parse_providers(self, children, consumer_group, consumer_version):
         """
-        从zk中可以根据接口名称获取到此接口某个provider的host
-        :param interface:
-        :param consumer_group: 消费者group
-        :param consumer_version: 消费者version
+        把providers下的子节点解析为provider，并根据group以及version进行过滤
+        :param children:
+        :param consumer_group:
+        :param consumer_version:
         :return:
         """
-        if interface not in self.hosts:
-            self.lock.acquire()
-            try:
-                if interface not in self.hosts:
-                    path = DUBBO_ZK_PROVIDERS.format(interface)
-                    if self.zk.exists(path):
-                        self._get_providers_from_zk(path, interface, consumer_group, consumer_version)
-                        self._get_configurators_from_zk(interface)
-                    else:
-                        raise RegisterException('No providers for interface {0}'.format(interface))
-            finally:
-                self.lock.release()
-        return self._routing_with_wight(interface)
-
-    def _warp_watch(self, consumer_group, consumer_version):
-        def _watch_children(event):
-            """
-            对某个provider下的子节点进行监听，一旦provider发生了变化则对本地缓存进行更新
-            :param event:
-            :return:
-            """
-            path = event.path
-            logger.debug('zookeeper node changed: {}'.format(path))
-            interface = path.split('/')[2]
-
-            providers = self.zk.get_children(path, watch=self._warp_watch(consumer_group, consumer_version))
-            providers = list(filter(lambda provider: provider['scheme'] == 'dubbo', map(parse_url, providers)))
-            # filter with group, version
-            providers = self._filter_with_group_version(providers, consumer_group, consumer_version)
-            if not providers:
-                logger.debug('no providers for interface {}'.format(interface))
-                self.hosts[interface] = []
-                return
-            self.hosts[interface] = list(map(lambda provider: provider['host'], providers))
-            logger.debug('{} providers: {}'.format(interface, self.hosts[interface]))
-
-        return _watch_children
+        providers = list(filter(lambda provider: provider['scheme'] == 'dubbo', map(parse_url, children)))
+        # filter with group, version
+        return self._filter_with_group_version(providers, consumer_group, consumer_version)
 
-    def _get_providers_from_zk(self, path, interface, consumer_group, consumer_version):
+    def _set_providers(self, interface, providers):
         """
-        从zk中根据interface获取到providers信息
-        :param path:
+        更新本地缓存的providers
         :param interface:
+        :param providers:
         :return:
         """
-        providers = self.zk.get_children(path, watch=self._warp_watch(consumer_group, consumer_version))
-        providers = list(filter(lambda provider: provider['scheme'] == 'dubbo', map(parse_url, providers)))
-        # filter with group, version
-        providers = ZkRegister._filter_with_group_version(providers, consumer_group, consumer_version)
         if not providers:
-            raise RegisterException('no providers for interface {}'.format(interface))
-        self._register_consumer(providers)
+            logger.debug('no providers for interface %s', interface)
         self.hosts[interface] = list(map(lambda provider: provider['host'], providers))
+        self._update_cum_weights(interface)
+        logger.debug('%s providers: %s', interface, self.hosts[interface])
+
+    def _set_configurators(self, interface, children):
+        """
+        从configurators下的子节点中取出权重相关的信息，更新本地缓存的权重
+        :param interface:
+        :param children:
+        :return:
+        """
+        conf = {}
+        for configurator in map(parse_url, children):
+            conf[configurator['host']] = configurator['fields'].get('weight', 100)  # 默认100
+        logger.debug('%s configurators: %s', interface, conf)
+        self.weights[interface] = conf
+        self._update_cum_weights(interface)
 
     @staticmethod
     def _filter_with_group_version(providers, consumer_group, consumer_version) -> list:
         return list(filter(lambda provider:
                            (consumer_group is None or '*' == consumer_group or provider['fields'].get('group') == consumer_group
-                            or ZkRegister.is_contain(consumer_group, provider['fields'].get('group'))
-                            or ZkRegister.is_contain(consumer_group, provider['fields'].get('default.group'))
+                            or BaseZkRegister.is_contain(consumer_group, provider['fields'].get('group'))
+                            or BaseZkRegister.is_contain(consumer_group, provider['fields'].get('default.group'))
                             and (
                             consumer_version is None or '*' == consumer_version
                             or provider['fields'].get('version') == consumer_version
-                            or ZkRegister.is_contain(consumer_version, provider['fields'].get('version'))
+                            or BaseZkRegister.is_contain(consumer_version, provider['fields'].get('version'))
                             )), providers))
 
     @staticmethod
@@ -230,54 +200,15 @@ class ZkRegister(object):
         if value in contains_value.split(','):
             return True
 
-    def _get_configurators_from_zk(self, interface):
-        """
-        试图从配置中取出权重相关的信息
-        :param interface:
-        :return:
-        """
-        configurators = self.zk.get_children(DUBBO_ZK_CONFIGURATORS.format(interface), watch=self._watch_configurators)
-        if configurators:
-            configurators = map(parse_url, configurators)
-            conf = {}
-            for configurator in configurators:
-                conf[configurator['host']] = configurator['fields'].get('weight', 100)  # 默认100
-            self.weights[interface] = conf
-
-    def _watch_configurators(self, event):
-        """
-        监测某个interface中provider的权重的变化信息
-        :param event:
-        :return:
-        """
-        path = event.path
-        logger.debug('zookeeper node changed: {}'.format(path))
-        interface = path.split('/')[2]
-
-        # 试图从配置中取出权重相关的信息
-        configurators = self.zk.get_children(DUBBO_ZK_CONFIGURATORS.format(interface),
-                                             watch=self._watch_configurators)
-        if configurators:
-            configurators = map(parse_url, configurators)
-            conf = {}
-            for configurator in configurators:
-                conf[configurator['host']] = configurator['fields'].get('weight', 100)
-            logger.debug('{} configurators: {}'.format(interface, conf))
-            self.weights[interface] = conf
-        else:
-            logger.debug('No configurator for interface {}')
-            self.weights[interface] = {}
-
-    def _register_consumer(self, providers):
+    def _consumer_node(self, providers):
         """
-        把本机注册到对应的interface的consumer上去
+        生成把本机注册为consumer的zk节点
         :param providers:
-        :return:
+        :return: consumers目录的路径，consumer节点的名称
         """
         provider = providers[0]
         provider_fields = provider['fields']
 
-        consumer = 'consumer://' + get_ip() + provider['path'] + '?'
         fields = {
             'application': self.application_name,
             'category': 'consumers',
@@ -286,27 +217,38 @@ class ZkRegister(object):
             'dubbo': provider_fields['dubbo'],
             'interface': provider_fields['interface'],
             'methods': provider_fields['methods'],
-            'pid': get_pid(),
+            'pid': self._pid,
             'side': 'consumer',
-            'timestamp': int(time.time() * 1000),            
+            'timestamp': int(time.time() * 1000),
         }
 
         if provider_fields.get('revision'):
             fields['revision'] = provider_fields.get('revision')
-        
+
         if provider_fields.get('version'):
             fields['version'] = provider_fields.get('version')
-        
 
-        params = []
-        for key, value in sorted(fields.items()):
-            params.append('{0}={1}'.format(key, value))
-        consumer += '&'.join(params)
+        # 参数值不单独编码，整个url只在最后编码一次，与Dubbo的URL.encode(toFullString())一致
+        query = '&'.join('{0}={1}'.format(key, value) for key, value in sorted(fields.items()))
+        consumer = 'consumer://' + self._ip + provider['path'] + '?' + query
 
-        logger.debug('Create consumer {}'.format(fields))
-        consumer_path = DUBBO_ZK_CONSUMERS.format(fields['interface'])
-        self.zk.ensure_path(consumer_path)
-        self.zk.create_async(consumer_path + '/' + quote(consumer, safe=''), ephemeral=True)
+        logger.debug('Create consumer %s', fields)
+        return DUBBO_ZK_CONSUMERS.format(fields['interface']), quote(consumer, safe='')
+
+    def _update_cum_weights(self, interface):
+        """
+        根据当前的hosts以及权重信息重新计算累加权重，供路由时二分查找
+        :param interface:
+        :return:
+        """
+        hosts = self.hosts.get(interface)
+        weights = self.weights.get(interface)
+        # 此接口没有权重设置，使用朴素的路由算法
+        if not hosts or not weights:
+            self._cum_weights.pop(interface, None)
+            return
+        cum_weights = list(itertools.accumulate(int(weights.get(host, 100)) for host in hosts))
+        self._cum_weights[interface] = hosts, cum_weights, cum_weights[-1]
 
     def _routing_with_wight(self, interface):
         """
@@ -317,21 +259,186 @@ class ZkRegister(object):
         hosts = self.hosts[interface]
         if not hosts:
             raise RegisterException('no providers for interface {}'.format(interface))
-        # 此接口没有权重设置，使用朴素的路由算法
-        if interface not in self.weights or not self.weights[interface]:
+        cum_weights = self._cum_weights.get(interface)
+        if not cum_weights:
             return random.choice(hosts)
 
-        weights = self.weights[interface]
-        hosts_weight = []
-        for host in hosts:
-            hosts_weight.append(int(weights.get(host, 100)))
+        hosts, cum_weights, total = cum_weights
+        if total <= 0:
+            raise RegisterException('Error for finding [{}] host with weight.'.format(interface))
+        return hosts[bisect_right(cum_weights, random.randrange(total))]
+
+
+class ZkRegister(BaseZkRegister):
+    """
+    ZkRegister的主要作用：
+    1. 根据特定的interface从zk中取出与之相关的所有provider的host并且监听
+       provider的变化，当发生变化时更新最新的hosts到本地缓存；
+    2. 当从zk中获取指定的interface的provider的时候，把当前进程作为此interface
+       的一个consumer注册到zk中，并设置此节点的状态为ephemeral；
+    """
+
+    def __init__(self, hosts, application_name='kiki_manager'):
+        """
+        :param hosts: Zookeeper的地址
+        :param application_name: 当前客户端的名称
+        """
+        BaseZkRegister.__init__(self, application_name)
+        zk = KazooClient(hosts=hosts)
+        # 对zookeeper连接状态的监控
+        zk.add_listener(self.state_listener)
+        zk.start()
 
-        hit = random.randint(0, sum(hosts_weight) - 1)
-        for i in range(len(hosts)):
-            if hit <= sum(hosts_weight[:i + 1]):
-                return hosts[i]
+        self.zk = zk
+        # 每个interface一把锁，不同interface的首次解析可以并行进行；
+        # 监听的首次回调与加锁的首次解析在同一个线程中执行，因此需要可重入锁
+        self._interface_locks = {}
+        # 仅用于保护_interface_locks本身
+        self._locks_guard = threading.Lock()
+        # 已经安装了监听的interface，避免首次解析失败重试时重复添加监听
+        self._watched_interfaces = set()
+        # (interface, category) -> 当前有效的子节点监听的代数，旧的监听在下一次触发时自行停止
+        self._watch_generations = {}
 
-        raise RegisterException('Error for finding [{}] host with weight.'.format(interface))
+    @staticmethod
+    def state_listener(state):
+        logger.debug('Current state -> %s', state)
+        if state == KazooState.LOST:
+            logger.debug('The session to register has lost.')
+        elif state == KazooState.SUSPENDED:
+            logger.debug('Disconnected from zookeeper.')
+        else:
+            logger.debug('Connected or disconnected to zookeeper.')
+
+    def get_provider_host(self, interface, consumer_group, consumer_version):
+        """
+        从zk中可以根据接口名称获取到此接口某个provider的host
+        :param interface:
+        :param consumer_group: 消费者group
+        :param consumer_version: 消费者version
+        :return:
+        """
+        if interface not in self.hosts:
+            with self._interface_lock(interface):
+                if interface not in self.hosts:
+                    # 先安装监听再读取节点，读取与监听之间发生的变化也能被感知到
+                    if interface not in self._watched_interfaces:
+                        self._watch_interface(interface, consumer_group, consumer_version)
+                    path = DUBBO_ZK_PROVIDERS.format(interface)
+                    # 节点不存在时get_children会直接抛出NoNodeError，无需事先调用exists
+                    try:
+                        self._get_providers_from_zk(path, interface, consumer_group, consumer_version)
+                    except NoNodeError:
+                        raise RegisterException('No providers for interface {0}'.format(interface))
+                    self._get_configurators_from_zk(interface)
+        return self._routing_with_wight(interface)
+
+    def _interface_lock(self, interface):
+        """
+        获取某个interface对应的锁
+        :param interface:
+        :return:
+        """
+        with self._locks_guard:
+            return self._interface_locks.setdefault(interface, threading.RLock())
+
+    def _watch_interface(self, interface, consumer_group, consumer_version):
+        """
+        监听/dubbo/{interface}下的分类节点，并对其中的providers以及configurators的子节点进行监听；
+        ChildrenWatch在节点不存在时会永久停止，因此分类节点每次增删时都重新创建子节点的监听，
+        这样后来才创建的configurators（例如通过dubbo-admin设置权重）也能被监听到
+        :param interface:
+        :param consumer_group:
+        :param consumer_version:
+        :return:
+        """
+        handlers = {
+            'providers': lambda children: self._watch_providers(interface, consumer_group, consumer_version,
+                                                                children),
+            'configurators': lambda children: self._watch_configurators(interface, children),
+        }
+        interface_path = DUBBO_ZK_INTERFACE.format(interface)
+
+        def _watch_children(category, generation):
+            def _on_children(children):
+                with self._interface_lock(interface):
+                    if self._watch_generations.get((interface, category)) != generation:
+                        return False  # 已被新的监听取代，返回False停止此监听
+                    # 首次解析尚未成功时忽略变化，下次调用时会重新读取
+                    if interface in self.hosts:
+                        handlers[category](children)
+
+            return _on_children
+
+        def _watch_categories(categories):
+            with self._interface_lock(interface):
+                # 节点不存在时ChildrenWatch不会回调，此时不标记，下次解析时重新监听
+                self._watched_interfaces.add(interface)
+                for category in handlers:
+                    generation = self._watch_generations.get((interface, category), 0) + 1
+                    self._watch_generations[(interface, category)] = generation
+                    if category in categories:
+                        self.zk.ChildrenWatch('{0}/{1}'.format(interface_path, category),
+                                              _watch_children(category, generation))
+                    elif interface in self.hosts:
+                        handlers[category]([])
+
+        self.zk.ChildrenWatch(interface_path, _watch_categories)
+
+    def _watch_providers(self, interface, consumer_group, consumer_version, children):
+        """
+        provider发生了变化时对本地缓存进行更新
+        :param interface:
+        :param consumer_group:
+        :param consumer_version:
+        :param children: providers下最新的子节点
+        :return:
+        """
+        self._set_providers(interface, self._parse_providers(children, consumer_group, consumer_version))
+
+    def _get_providers_from_zk(self, path, interface, consumer_group, consumer_version):
+        """
+        从zk中根据interface获取到providers信息
+        :param path:
+        :param interface:
+        :return:
+        """
+        providers = self._parse_providers(self.zk.get_children(path), consumer_group, consumer_version)
+        if not providers:
+            raise RegisterException('no providers for interface {}'.format(interface))
+        self._register_consumer(providers)
+        self._set_providers(interface, providers)
+
+    def _get_configurators_from_zk(self, interface):
+        """
+        试图从配置中取出权重相关的信息
+        :param interface:
+        :return:
+        """
+        try:
+            children = self.zk.get_children(DUBBO_ZK_CONFIGURATORS.format(interface))
+        except NoNodeError:
+            children = []
+        self._set_configurators(interface, children)
+
+    def _watch_configurators(self, interface, children):
+        """
+        监测某个interface中provider的权重的变化信息
+        :param interface:
+        :param children: configurators下最新的子节点
+        :return:
+        """
+        self._set_configurators(interface, children)
+
+    def _register_consumer(self, providers):
+        """
+        把本机注册到对应的interface的consumer上去
+        :param providers:
+        :return:
+        """
+        consumer_path, consumer = self._consumer_node(providers)
+        self.zk.ensure_path(consumer_path)
+        self.zk.create_async(consumer_path + '/' + consumer, ephemeral=True)
 
     def close(self):
         self.zk.stop()
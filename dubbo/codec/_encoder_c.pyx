@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+from libc.math cimport isfinite, trunc
+from libc.stdint cimport int32_t, int64_t, uint64_t
+from libc.string cimport memcpy
+
+"""
+Hessian数值类型编码的C实现，与dubbo.codec.encoder.Request中对应的纯Python实现输出完全一致
+编译：pip install cython && python setup.py build_ext --inplace
+"""
+
+cdef int64_t MAX_INT_32 = 2147483647
+cdef int64_t MIN_INT_32 = -2147483648
+
+
+cdef inline Py_ssize_t _write_tag_64(unsigned char *buf, unsigned char tag, uint64_t bits):
+    cdef int i
+    buf[0] = tag
+    for i in range(8):
+        buf[8 - i] = <unsigned char> (bits >> (8 * i))
+    return 9
+
+
+cdef inline Py_ssize_t _write_tag_32(unsigned char *buf, unsigned char tag, int64_t value):
+    buf[0] = tag
+    buf[1] = <unsigned char> (value >> 24)
+    buf[2] = <unsigned char> (value >> 16)
+    buf[3] = <unsigned char> (value >> 8)
+    buf[4] = <unsigned char> value
+    return 5
+
+
+def encode_long(object value):
+    """
+    对长整型进行编码
+    :param value:
+    :return:
+    """
+    cdef unsigned char buf[9]
+    cdef int64_t v = value
+    _write_tag_64(buf, 0x4c, <uint64_t> v)  # 'L'
+    return (<char *> buf)[:9]
+
+
+def encode_int(object value):
+    """
+    对整数进行编码
+    :param value:
+    :return:
+    """
+    cdef unsigned char buf[9]
+    cdef Py_ssize_t n
+    cdef int64_t v = value
+
+    # 超出int类型范围的值则转化为long类型
+    if v > MAX_INT_32 or v < MIN_INT_32:
+        n = _write_tag_64(buf, 0x4c, <uint64_t> v)  # 'L'
+    elif -0x10 <= v <= 0x2f:
+        buf[0] = <unsigned char> (v + 0x90)
+        n = 1
+    elif -0x800 <= v <= 0x7ff:
+        buf[0] = <unsigned char> (0xc8 + (v >> 8))
+        buf[1] = <unsigned char> v
+        n = 2
+    elif -0x40000 <= v <= 0x3ffff:
+        buf[0] = <unsigned char> (0xd4 + (v >> 16))
+        buf[1] = <unsigned char> (v >> 8)
+        buf[2] = <unsigned char> v
+        n = 3
+    else:
+        n = _write_tag_32(buf, 0x49, v)  # 'I'
+    return (<char *> buf)[:n]
+
+
+def encode_float(object value):
+    """
+    对浮点类型进行编码
+    :param value:
+    :return:
+    """
+    cdef unsigned char buf[9]
+    cdef double v = value
+    cdef double m
+    cdef int64_t int_value, mills
+    cdef uint64_t bits
+
+    if not isfinite(v):
+        int(value)  # 与纯Python实现保持一致，inf以及nan在这里抛出异常
+
+    if trunc(v) == v and -0x8000 <= v < 0x8000:
+        int_value = <int64_t> v
+        if int_value == 0:
+            return b'\x5b'
+        elif int_value == 1:
+            return b'\x5c'
+        elif -0x80 <= int_value < 0x80:
+            buf[0] = 0x5d
+            buf[1] = <unsigned char> int_value
+            return (<char *> buf)[:2]
+        else:
+            buf[0] = 0x5e
+            buf[1] = <unsigned char> (int_value >> 8)
+            buf[2] = <unsigned char> int_value
+            return (<char *> buf)[:3]
+
+    m = v * 1000
+    if MIN_INT_32 - 1 < m < MAX_INT_32 + 1:
+        mills = <int64_t> m
+        if 0.001 * mills == v:
+            return (<char *> buf)[:_write_tag_32(buf, 0x5f, mills)]
+
+    memcpy(&bits, &v, 8)
+    return (<char *> buf)[:_write_tag_64(buf, 0x44, bits)]  # 'D'
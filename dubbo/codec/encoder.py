@@ -19,12 +19,20 @@
 """
 import calendar
 import datetime
+import functools
+import re
 import struct
 from typing import Mapping, Union
 
 from dubbo.common.constants import MIN_INT_32, MAX_INT_32, DEFAULT_REQUEST_META
 from dubbo.common.exceptions import HessianTypeError
-from dubbo.common.util import double_to_long_bits, get_invoke_id
+from dubbo.common.util import get_invoke_id
+
+try:
+    # 可选的C扩展，需要通过Cython编译，未编译时使用纯Python实现
+    from dubbo.codec import _encoder_c
+except ImportError:
+    _encoder_c = None
 
 """
 把Python的数据结构根据Hessian协议序列化为相应的字节数组
@@ -38,6 +46,22 @@ from dubbo.common.util import double_to_long_bits, get_invoke_id
 * java.lang.Object
 """
 
+# 预编译的数值编码格式，标签字节与数值一次性打包，struct.pack输出的字节已经是截断好的
+_S_HEAD = struct.Struct('>qi')  # 请求头中的invoke_id + body长度
+_S_I = struct.Struct('>Bi')  # 'I' + int32
+_S_L = struct.Struct('>Bq')  # 'L' + int64
+_S_D = struct.Struct('>Bd')  # 'D' + double
+_S_MILL = struct.Struct('>Bi')  # 0x5f + int32，以千分之一为单位的double
+_S_INT_BYTE = struct.Struct('>BB')  # 0xc8 + 1字节的紧凑int
+_S_INT_SHORT = struct.Struct('>BH')  # 0xd4 + 2字节的紧凑int
+_S_DOUBLE_BYTE = struct.Struct('>Bb')  # 0x5d + 1字节的double
+_S_DOUBLE_SHORT = struct.Struct('>Bh')  # 0x5e + 2字节的double
+_S_STR_SHORT = struct.Struct('>BB')  # 0x30 + 1字节的字符串长度
+_S_STR = struct.Struct('>BH')  # 'S' + 2字节的字符串长度
+
+# 与参数值无关的Java类型签名，直接根据type查表
+_TYPE_SIG = {bool: 'Z', float: 'D', str: 'Ljava/lang/String;'}
+
 
 class Object(object):
     """
@@ -120,7 +144,7 @@ class Request(object):
 
     def __init__(self, request):
         self.__body = request
-        self.__classes = []
+        self.__classes = {}  # 类路径 -> class_id
         self.types = []  # 泛型
         self.invoke_id = get_invoke_id()
 
@@ -129,10 +153,12 @@ class Request(object):
         把请求序列化为字节数组
         :return:
         """
-        request_body = self._encode_request_body()
-        invoke_id = list(bytearray(struct.pack('!q', self.invoke_id)))
-        request_head = DEFAULT_REQUEST_META + invoke_id + get_request_body_length(request_body)
-        return bytearray(request_head + request_body)
+        # 第一个位置留给头部，body的各个片段编码完成后再计算长度，最后一次性拼接，整个请求只拷贝一遍
+        pieces = [b'']
+        self._encode_request_body(pieces)
+        body_length = sum(map(len, pieces))
+        pieces[0] = DEFAULT_REQUEST_META + _S_HEAD.pack(self.invoke_id, body_length)
+        return b''.join(pieces)
 
     def _get_parameter_types(self, arguments):
         """
@@ -140,11 +166,7 @@ class Request(object):
         :param arguments:
         :return:
         """
-        parameter_types = ''
-        # 判断并得出参数的类型
-        for argument in arguments:
-            parameter_types += self._get_class_name(argument)
-        return parameter_types
+        return ''.join([self._get_class_name(argument) for argument in arguments])
 
     def _get_class_name(self, _class):
         """
@@ -153,6 +175,13 @@ class Request(object):
         :param _class:
         :return:
         """
+        sig = _TYPE_SIG.get(type(_class))
+        if sig is not None:
+            return sig
+        if type(_class) is int:
+            return 'I' if MIN_INT_32 <= _class <= MAX_INT_32 else 'J'
+
+        # 子类等其它情况
         if isinstance(_class, bool):  # bool类型的判断必须放在int类型判断的前面
             return 'Z'
         elif isinstance(_class, int):
@@ -165,9 +194,7 @@ class Request(object):
         elif isinstance(_class, (str)):
             return 'L' + 'java/lang/String' + ';'
         elif isinstance(_class, Object):
-            path = _class.get_path()
-            path = 'L' + path.replace('.', '/') + ';'
-            return path
+            return _object_sig(_class.get_path())
         elif isinstance(_class, list):
             if len(_class) == 0:
                 raise HessianTypeError('Method parameter {} is a list but length is zero'.format(_class))
@@ -175,9 +202,10 @@ class Request(object):
         else:
             raise HessianTypeError('Unknown argument type: {0}'.format(_class))
 
-    def _encode_request_body(self):
+    def _encode_request_body(self, pieces):
         """
         对所有的已知的参数根据dubbo协议进行编码
+        :param pieces: 编码得到的字节片段追加到此列表中
         :return:
         """
         dubbo_version = self.__body.get('dubbo_version')
@@ -187,33 +215,13 @@ class Request(object):
         arguments = self.__body.get('arguments')
         group = self.__body.get('group')
 
-        body = []
-        body.extend(self._encode_single_value(dubbo_version))
-        body.extend(self._encode_single_value(path))
-        body.extend(self._encode_single_value(version))
-        body.extend(self._encode_single_value(method))
-        body.extend(self._encode_single_value(self._get_parameter_types(arguments)))
-        for argument in arguments:
-            body.extend(self._encode_single_value(argument))
-        attachments = {
-            'path': path,
-            'interface': path,
-            'version': version,
-        }
-        if group:
-            attachments.update({'group': group})
-        # attachments参数以H开头，以Z结尾
-        body.append(ord('H'))
-        for key in attachments.keys():
-            value = attachments[key]
-            body.extend(self._encode_single_value(key))
-            body.extend(self._encode_single_value(value))
-        body.append(ord('Z'))
-
-        # 因为在上面的逻辑中没有对byte大小进行检测，所以在这里进行统一的处理
-        for i in range(len(body)):
-            body[i] = body[i] & 0xff
-        return body
+        # 同一个方法以相同的参数类型调用时，除参数值以外的部分都是固定的，直接使用缓存好的字节
+        parameter_types = self._get_parameter_types(arguments)
+        pieces.append(_encode_request_prefix(dubbo_version, path, version, method, parameter_types))
+        encode = self._encode_single_value
+        pieces.extend([encode(argument) for argument in arguments])
+        pieces.append(_encode_attachments(path, version, group))
+        return pieces
 
     @staticmethod
     def _encode_bool(value):
@@ -222,12 +230,7 @@ class Request(object):
         :param value:
         :return:
         """
-        result = []
-        if value:
-            result.append(ord('T'))
-        else:
-            result.append(ord('F'))
-        return result
+        return b'T' if value else b'F'
 
     @staticmethod
     def _encode_int(value):
@@ -236,42 +239,27 @@ class Request(object):
         :param value:
         :return:
         """
-        result = []
         # 超出int类型范围的值则转化为long类型
         # 这里问题在于对于落在int范围内的数字，我们无法判断其是long类型还是int类型，所以一律认为其是int类型
         if value > MAX_INT_32 or value < MIN_INT_32:
-            result.append(ord('L'))
-            result.extend(list(bytearray(struct.pack('!q', value))))
-            return result
+            return _S_L.pack(0x4c, value)  # 'L'
 
         if -0x10 <= value <= 0x2f:
-            result.append(value + 0x90)
+            return bytes((value + 0x90,))
         elif -0x800 <= value <= 0x7ff:
-            result.append(0xc8 + (value >> 8))
-            result.append(value)
+            return _S_INT_BYTE.pack(0xc8 + (value >> 8), value & 0xff)
         elif -0x40000 <= value <= 0x3ffff:
-            result.append(0xd4 + (value >> 16))
-            result.append(value >> 8)
-            result.append(value)
+            return _S_INT_SHORT.pack(0xd4 + (value >> 16), value & 0xffff)
         else:
-            result.append(ord('I'))
-            result.append(value >> 24)
-            result.append(value >> 16)
-            result.append(value >> 8)
-            result.append(value)
-        return result
+            return _S_I.pack(0x49, value)  # 'I'
 
     @staticmethod
     def _encode_datetime(value):
-        result = []
-        result.extend(list(bytearray(struct.pack('>cq', b'd', int(calendar.timegm(value.timetuple())) * 1000))))
-        return result
+        return _S_L.pack(0x64, int(calendar.timegm(value.timetuple())) * 1000)  # 'd'
 
     @staticmethod
     def _encode_long(value):
-        result = []
-        result.extend(list(bytearray(struct.pack('>cq', b'L', value))))
-        return result
+        return _S_L.pack(0x4c, value)  # 'L'
 
     @staticmethod
     def _encode_float(value):
@@ -280,91 +268,39 @@ class Request(object):
         :param value:
         :return:
         """
-        result = []
         int_value = int(value)
         if int_value == value:
             if int_value == 0:
-                result.append(0x5b)
-                return result
+                return b'\x5b'
             elif int_value == 1:
-                result.append(0x5c)
-                return result
+                return b'\x5c'
             elif -0x80 <= int_value < 0x80:
-                result.append(0x5d)
-                result.append(int_value)
-                return result
+                return _S_DOUBLE_BYTE.pack(0x5d, int_value)
             elif -0x8000 <= int_value < 0x8000:
-                result.append(0x5e)
-                result.append(int_value >> 8)
-                result.append(int_value)
-                return result
+                return _S_DOUBLE_SHORT.pack(0x5e, int_value)
 
         mills = int(value * 1000)
         if 0.001 * mills == value and MIN_INT_32 <= mills <= MAX_INT_32:
-            result.append(0x5f)
-            result.append(mills >> 24)
-            result.append(mills >> 16)
-            result.append(mills >> 8)
-            result.append(mills)
-            return result
-
-        bits = double_to_long_bits(value)
-        result.append(ord('D'))
-        result.append(bits >> 56)
-        result.append(bits >> 48)
-        result.append(bits >> 40)
-        result.append(bits >> 32)
-        result.append(bits >> 24)
-        result.append(bits >> 16)
-        result.append(bits >> 8)
-        result.append(bits)
-        return result
+            return _S_MILL.pack(0x5f, mills)
 
-    @staticmethod
-    def _encode_utf(value):
-        """
-        对字符串进行编码，编码格式utf-8
-        参见方法：com.alibaba.com.caucho.hessian.io.Hessian2Output#printString
-        :param value:
-        :return:
-        """
-        result = []
-        for v in value:
-            ch = v
-            if ch < 0x80:
-                result.append(ch & 0xff)
-            elif ch < 0x800:
-                result.append((0xc0 + ((ch >> 6) & 0x1f)) & 0xff)
-                result.append((0x80 + (ch & 0x3f)) & 0xff)
-            else:
-                result.append((0xe0 + ((ch >> 12) & 0xf)) & 0xff)
-                result.append((0x80 + ((ch >> 6) & 0x3f)) & 0xff)
-                result.append((0x80 + (ch & 0x3f)) & 0xff)
-        return result
+        return _S_D.pack(0x44, value)  # 'D'
 
-    def _encode_str(self, value):
+    @staticmethod
+    def _encode_str(value):
         """
-        对一个字符串进行编码
+        对一个字符串进行编码，长度为Java中char的个数，内容为utf-8编码后的字节
         :param value:
         :return:
         """
-        result = []
-        # 在进行网络传输操作时一律使用unicode进行操作
-        if isinstance(value, str):
-            value = value.encode('utf-8')
+        value = _to_java_chars(value)
+        encoded = value.encode('utf-8', 'surrogatepass')
         length = len(value)
         if length <= 0x1f:
-            result.append(0x00 + length)
+            return bytes((length,)) + encoded
         elif length <= 0x3ff:
-            result.append(0x30 + (length >> 8))
-            result.append(length)
+            return _S_STR_SHORT.pack(0x30 + (length >> 8), length & 0xff) + encoded
         else:
-            result.append(ord('S'))
-            result.append(length >> 8)
-            result.append(length)
-
-        result.extend(self._encode_utf(value))
-        return result
+            return _S_STR.pack(0x53, length & 0xffff) + encoded  # 'S'
 
     def _encode_object(self, value):
         """
@@ -372,48 +308,47 @@ class Request(object):
         :param value:
         :return:
         """
-        result = []
+        pieces = []
         path = value.get_path()
         field_names = value.keys()
 
-        if path not in self.__classes:
-            result.append(ord('C'))
-            result.extend(self._encode_single_value(path))
+        class_id = self.__classes.get(path)
+        if class_id is None:
+            pieces.append(b'C')
+            pieces.append(self._encode_single_value(path))
 
-            result.extend(self._encode_single_value(len(field_names)))
+            pieces.append(self._encode_single_value(len(field_names)))
 
             for field_name in field_names:
-                result.extend(self._encode_single_value(field_name))
-            self.__classes.append(path)
-        class_id = self.__classes.index(path)
+                pieces.append(self._encode_single_value(field_name))
+            class_id = len(self.__classes)
+            self.__classes[path] = class_id
         if class_id <= 0xf:
-            class_id += 0x60
-            class_id &= 0xff
-            result.append(class_id)
+            pieces.append(bytes((0x60 + class_id,)))
         else:
-            result.append(ord('O'))
-            result.extend(self._encode_single_value(class_id))
+            pieces.append(b'O')
+            pieces.append(self._encode_single_value(class_id))
         for field_name in field_names:
             if value.has_meta(field_name):
                 field_meta = value.get_meta(field_name)
                 if field_meta == 'java.math.BigDecimal':
-                    result.extend(self._encode_map_object(BigDecimal(value[field_name])))
+                    pieces.append(self._encode_map_object(BigDecimal(value[field_name])))
                 if field_meta == 'java.math.BigInteger':
-                    result.extend(self._encode_map_object(BigInteger(value[field_name])))
+                    pieces.append(self._encode_map_object(BigInteger(value[field_name])))
                 if field_meta == 'long':
-                    result.extend(self._encode_long(int(value[field_name])))
+                    pieces.append(self._encode_long(int(value[field_name])))
             else:
-                result.extend(self._encode_single_value(value[field_name]))
-        return result
+                pieces.append(self._encode_single_value(value[field_name]))
+        return b''.join(pieces)
 
     def _encode_map_object(self, value: Object):
-        result = []
-        result.extend(list(bytearray(struct.pack('!c', b'M'))))
-        result.extend(self._encode_single_value(value.get_path()))
-        result.extend(self._encode_single_value('value'))
-        result.extend(self._encode_single_value(str(value['value'])))
-        result.extend(list(bytearray(struct.pack('!c', b'Z'))))
-        return result
+        return b''.join((
+            b'M',
+            self._encode_single_value(value.get_path()),
+            self._encode_single_value('value'),
+            self._encode_single_value(str(value['value'])),
+            b'Z',
+        ))
 
     def _encode_list(self, value):
         """
@@ -421,7 +356,7 @@ class Request(object):
         :param value:
         :return:
         """
-        result = []
+        pieces = []
         length = len(value)
         if length == 0:
             # 没有值则无法判断类型，一律返回null
@@ -439,26 +374,30 @@ class Request(object):
         else:
             raise HessianTypeError('Unknown list type: {}'.format(value[0]))
         if length < 0x7:
-            result.append(0x70 + length)
+            pieces.append(bytes((0x70 + length,)))
             if _type not in self.types:
                 self.types.append(_type)
-                result.extend(self._encode_single_value(_type))
+                pieces.append(self._encode_single_value(_type))
             else:
-                result.extend(self._encode_single_value(self.types.index(_type)))
+                pieces.append(self._encode_single_value(self.types.index(_type)))
         else:
-            result.append(0x56)
+            pieces.append(b'\x56')
             if _type not in self.types:
                 self.types.append(_type)
-                result.extend(self._encode_single_value(_type))
+                pieces.append(self._encode_single_value(_type))
             else:
-                result.extend(self._encode_single_value(self.types.index(_type)))
-            result.extend(self._encode_single_value(length))
+                pieces.append(self._encode_single_value(self.types.index(_type)))
+            pieces.append(self._encode_single_value(length))
         for v in value:
             if type(value[0]) != type(v):
                 raise HessianTypeError('All elements in list must be the same type, first type'
                                        ' is {0} but current type is {1}'.format(type(value[0]), type(v)))
-            result.extend(self._encode_single_value(v))
-        return result
+            pieces.append(self._encode_single_value(v))
+        return b''.join(pieces)
+
+    @staticmethod
+    def _encode_none(value):
+        return b'N'
 
     def _encode_single_value(self, value):
         """
@@ -466,6 +405,21 @@ class Request(object):
         :param value:
         :return:
         """
+        # 根据值的精确类型直接找到对应的编码方法，子类等其它情况再走isinstance判断
+        encoder = _VALUE_ENCODERS.get(type(value))
+        if encoder is not None:
+            return encoder(value)
+        encoder = _REQUEST_ENCODERS.get(type(value))
+        if encoder is not None:
+            return encoder(self, value)
+        return self._encode_fallback(value)
+
+    def _encode_fallback(self, value):
+        """
+        值的类型为支持类型的子类时，根据isinstance判断选择编码方法
+        :param value:
+        :return:
+        """
         # 布尔类型
         if isinstance(value, bool):
             return self._encode_bool(value)
@@ -488,18 +442,108 @@ class Request(object):
             return self._encode_list(value)
         # null
         elif value is None:
-            return [ord('N')]
+            return b'N'
         else:
             raise HessianTypeError('Unknown argument type: {}'.format(value))
 
 
-def get_request_body_length(body):
+# 纯Python实现，替换为C实现之后仍然保留，用于校验两者的输出一致
+_py_encode_int = Request._encode_int
+_py_encode_long = Request._encode_long
+_py_encode_float = Request._encode_float
+
+if _encoder_c is not None:
+    # 数值类型的编码是最频繁的操作，有C扩展时替换为C实现
+    Request._encode_int = staticmethod(_encoder_c.encode_int)
+    Request._encode_long = staticmethod(_encoder_c.encode_long)
+    Request._encode_float = staticmethod(_encoder_c.encode_float)
+
+# 类型 -> 编码方法，在模块级别只创建一次，不需要为每个请求创建绑定方法
+# 与请求无关的值的编码方法，直接以值调用
+_VALUE_ENCODERS = {
+    bool: Request._encode_bool,
+    int: Request._encode_int,
+    float: Request._encode_float,
+    str: Request._encode_str,
+    datetime.datetime: Request._encode_datetime,
+    type(None): Request._encode_none,
+}
+# 依赖于请求中状态（已定义的类）的编码方法，以(request, value)调用
+_REQUEST_ENCODERS = {
+    Object: Request._encode_object,
+    list: Request._encode_list,
+}
+
+
+@functools.lru_cache(maxsize=512)
+def _object_sig(path):
+    """
+    Java对象的类型签名，例如：java.lang.Object -> Ljava/lang/Object;
+    :param path:
+    :return:
+    """
+    return 'L' + path.replace('.', '/') + ';'
+
+
+def _encode_constant(value):
+    """
+    对请求中固定的字段进行编码，这些字段只能是字符串或者None
+    :param value:
+    :return:
+    """
+    if value is None:
+        return b'N'
+    if not isinstance(value, str):
+        raise HessianTypeError('Request field {} should be string type.'.format(value))
+    return Request._encode_str(value)
+
+
+@functools.lru_cache(maxsize=256)
+def _encode_request_prefix(dubbo_version, path, version, method, parameter_types):
+    """
+    请求body中位于参数之前的部分：dubbo版本、接口、版本、方法名以及参数类型
+    :return:
+    """
+    return b''.join(map(_encode_constant, (dubbo_version, path, version, method, parameter_types)))
+
+
+@functools.lru_cache(maxsize=256)
+def _encode_attachments(path, version, group):
+    """
+    请求body中位于参数之后的attachments，以H开头，以Z结尾
+    :return:
+    """
+    attachments = ['path', path, 'interface', path, 'version', version]
+    if group:
+        attachments += 'group', group
+    return b'H' + b''.join(map(_encode_constant, attachments)) + b'Z'
+
+
+_NON_BMP = re.compile('[\U00010000-\U0010ffff]')
+
+
+def _to_java_chars(value):
+    """
+    Java中的字符串以UTF-16存储，BMP以外的字符会被拆分为两个代理字符，
+    Hessian的字符串长度以及utf-8编码都是基于Java的char进行的
+    参见方法：com.alibaba.com.caucho.hessian.io.Hessian2Output#printString
+    :param value:
+    :return:
+    """
+    # 绝大多数字符串都不含BMP以外的字符，使用C实现的isascii以及正则检测，避免逐个字符遍历
+    if value.isascii() or not _NON_BMP.search(value):
+        return value
+    return _NON_BMP.sub(_surrogate_pair, value)
+
+
+def _surrogate_pair(match):
     """
-    获取body的长度，并将其转为长度为4个字节的字节数组
-    :param body:
+    把BMP以外的字符拆分为UTF-16的高低两个代理字符
+    :param match: _NON_BMP匹配到的单个字符
     :return:
     """
-    return list(bytearray(struct.pack('!i', len(body))))
+    code = ord(match.group()) - 0x10000
+    return chr(0xd800 + (code >> 10)) + chr(0xdc00 + (code & 0x3ff))
 
 
 if __name__ == '__main__':
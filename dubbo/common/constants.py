@@ -39,15 +39,16 @@ MAX_INT_32 = 2147483647
 MIN_INT_32 = -2147483648
 
 # MAGIC_NUM(2) + FLAG(1) + STATUS(1)
-DEFAULT_REQUEST_META = num_2_byte_list(0xdabbc200)
+DEFAULT_REQUEST_META = bytes(num_2_byte_list(0xdabbc200))
 
 # 客户端对服务端发送的心跳的请求的头部
-CLI_HEARTBEAT_REQ_HEAD = num_2_byte_list(0xdabbe2) + [0]
+CLI_HEARTBEAT_REQ_HEAD = bytes(num_2_byte_list(0xdabbe2) + [0])
 # 客户端对服务端发送的心跳的响应的头部
-CLI_HEARTBEAT_RES_HEAD = num_2_byte_list(0xdabb2214)
+CLI_HEARTBEAT_RES_HEAD = bytes(num_2_byte_list(0xdabb2214))
 # 心跳尾部
-CLI_HEARTBEAT_TAIL = [0, 0, 0, 1] + num_2_byte_list(0x4e)
+CLI_HEARTBEAT_TAIL = bytes([0, 0, 0, 1] + num_2_byte_list(0x4e))
 
+DUBBO_ZK_INTERFACE = '/dubbo/{}'
 DUBBO_ZK_PROVIDERS = '/dubbo/{}/providers'
 DUBBO_ZK_CONSUMERS = '/dubbo/{}/consumers'
 DUBBO_ZK_CONFIGURATORS = '/dubbo/{}/configurators'
@@ -18,6 +18,8 @@
  */
 """
 
+import asyncio
+import itertools
 import logging
 import select
 import socket
@@ -29,7 +31,7 @@ from dubbo.codec.encoder import Request
 from dubbo.codec.decoder import Response, parse_response_head
 from dubbo.common.constants import CLI_HEARTBEAT_RES_HEAD, CLI_HEARTBEAT_TAIL, CLI_HEARTBEAT_REQ_HEAD, \
     TIMEOUT_CHECK_INTERVAL, TIMEOUT_IDLE, TIMEOUT_MAX_TIMES, DEFAULT_READ_PARAMS
-from dubbo.common.exceptions import DubboResponseException, DubboRequestTimeoutException
+from dubbo.common.exceptions import DubboException, DubboResponseException, DubboRequestTimeoutException
 from dubbo.common.util import get_invoke_id
 
 logger = logging.getLogger('python-dubbo')
@@ -37,8 +39,10 @@ logger = logging.getLogger('python-dubbo')
 
 class BaseConnectionPool(object):
     def __init__(self):
-        # 根据远程host保存与此host相关的连接
+        # 根据(host, 连接序号)保存与此host相关的连接，每个host最多可以有多个连接
         self._connection_pool = {}
+        # 每个host轮询选择连接所使用的计数器
+        self._round_robin = {}
         # 用于在多个线程之间保存结果
         self.results = {}
         # 保存客户端已经发生超时的心跳次数
@@ -56,15 +60,16 @@ class BaseConnectionPool(object):
         scanning_thread.setDaemon(True)
         scanning_thread.start()
 
-    def get(self, host, request_param, timeout=None):
+    def get(self, host, request_param, timeout=None, connections=1):
         """
         执行远程调用获取数据
         :param host:
         :param request_param:
         :param timeout:
+        :param connections: 与此host之间最多建立的连接数，请求在这些连接之间轮询
         :return:
         """
-        conn = self._get_connection(host)
+        conn = self._get_connection(host, connections)
         request = Request(request_param)
         request_data = request.encode()
         invoke_id = request.invoke_id
@@ -88,28 +93,36 @@ class BaseConnectionPool(object):
             raise result
         return result
 
-    def _get_connection(self, host):
+    def _get_connection(self, host, connections=1):
         """
         通过host获取到与此host相关的socket，本地会对socket进行缓存
         :param host:
+        :param connections: 与此host之间最多建立的连接数
         :return:
         """
         if not host or ':' not in host:
             raise ValueError('invalid host {}'.format(host))
-        if host not in self._connection_pool:
+        index = 0
+        if connections > 1:
+            counter = self._round_robin.get(host)
+            if counter is None:
+                counter = self._round_robin.setdefault(host, itertools.count())
+            index = next(counter) % connections
+        key = host, index
+        if key not in self._connection_pool:
             self.conn_lock.acquire()
             try:
-                if host not in self._connection_pool:
-                    self.client_heartbeats[host] = 0
-                    self._new_connection(host)
+                if key not in self._connection_pool:
+                    self.client_heartbeats[key] = 0
+                    self._new_connection(key)
             finally:
                 self.conn_lock.release()
-        return self._connection_pool[host]
+        return self._connection_pool[key]
 
-    def _new_connection(self, host):
+    def _new_connection(self, key):
         """
         创建一个新的连接
-        :param host:
+        :param key: (host, 连接序号)
         :return:
         """
         raise NotImplementedError()
@@ -191,13 +204,11 @@ class BaseConnectionPool(object):
         if heartbeat == 2:
             logger.debug('❤ request  -> {}'.format(conn.remote_host()))
             msg_id = data[4:12]
-            heartbeat_response = CLI_HEARTBEAT_RES_HEAD + list(msg_id) + CLI_HEARTBEAT_TAIL
-            conn.write(bytearray(heartbeat_response))
+            conn.write(CLI_HEARTBEAT_RES_HEAD + msg_id + CLI_HEARTBEAT_TAIL)
             return body_length, 3, None if body_length > 0 else DEFAULT_READ_PARAMS
         elif heartbeat == 1:
             logger.debug('❤ response -> {}'.format(conn.remote_host()))
-            host = conn.remote_host()
-            self.client_heartbeats[host] -= 1
+            self.client_heartbeats[conn.pool_key()] -= 1
             return body_length, 3, None if body_length > 0 else DEFAULT_READ_PARAMS
 
         # 普通的数据包
@@ -256,9 +267,9 @@ class BaseConnectionPool(object):
         """
         while 1:
             starting = time.time()
-            for host in self._connection_pool.keys():
+            for key in list(self._connection_pool.keys()):
                 try:
-                    self._check_conn(host)
+                    self._check_conn(key)
                 except Exception as e:
                     logger.exception(e)
             ending = time.time()
@@ -266,30 +277,30 @@ class BaseConnectionPool(object):
             if time_delta < TIMEOUT_CHECK_INTERVAL:
                 time.sleep(TIMEOUT_CHECK_INTERVAL - time_delta)
 
-    def _check_conn(self, host):
+    def _check_conn(self, key):
         """
         对连接进行检查，查看是否超时或者已经达到最大的超时次数
-        :param host:
+        :param key: (host, 连接序号)
         :return:
         """
-        conn = self._connection_pool[host]
+        conn = self._connection_pool[key]
+        host = conn.remote_host()
         # 如果未达到最大的超时时间，则不进行任何操作
         if time.time() - conn.last_active <= TIMEOUT_IDLE:
             return
 
         # 达到最大的超时次数，对此连接进行重连
-        if self.client_heartbeats[host] >= TIMEOUT_MAX_TIMES:
-            self._new_connection(host)
-            self.client_heartbeats[host] = 0
+        if self.client_heartbeats[key] >= TIMEOUT_MAX_TIMES:
+            self._new_connection(key)
+            self.client_heartbeats[key] = 0
             conn.close()  # 关闭旧的连接
             logger.debug('{} timeout and reconnected by client.'.format(host))
 
         # 未达到最大的超时次数，超时次数+1且发送心跳包
         else:
-            self.client_heartbeats[host] += 1
+            self.client_heartbeats[key] += 1
             invoke_id = get_invoke_id()
-            req = CLI_HEARTBEAT_REQ_HEAD + list(bytearray(pack('!q', invoke_id))) + CLI_HEARTBEAT_TAIL
-            conn.write(bytearray(req))
+            conn.write(CLI_HEARTBEAT_REQ_HEAD + pack('!q', invoke_id) + CLI_HEARTBEAT_TAIL)
             logger.debug('Send ❤ request for invoke_id {}, host={}'.format(invoke_id, host))
 
 
@@ -316,14 +327,15 @@ class SelectConnectionPool(BaseConnectionPool):
                 except Exception as e:
                     logger.exception(e)
 
-    def _new_connection(self, host):
+    def _new_connection(self, key):
+        host, index = key
         ip, port = host.split(':')
-        self._connection_pool[host] = Connection(ip, int(port))
+        self._connection_pool[key] = Connection(ip, int(port), index)
         # 保证select模型已经开始监听最新加入的这个fd的读事件，否则可能会导致此fd读事件丢失
         time.sleep(self.select_timeout)
 
     def _delete_connection(self, conn):
-        del self._connection_pool[conn.remote_host()]
+        del self._connection_pool[conn.pool_key()]
 
 
 # connection_pool在整个进程中是单例的
@@ -335,7 +347,12 @@ class Connection(object):
     对Socket链接做了一些封装
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, index=0):
+        """
+        :param host:
+        :param port:
+        :param index: 与同一个远程主机之间的第几个连接
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.settimeout(5)
         sock.connect((host, port))
@@ -343,9 +360,10 @@ class Connection(object):
         sock.setblocking(False)
         self.__sock = sock
         self.__host = '{0}:{1}'.format(host, port)
+        self.__index = index
 
         self.read_length, self.read_type, self.invoke_id = DEFAULT_READ_PARAMS
-        self.read_buffer = []
+        self.read_buffer = bytearray()
 
         self.last_active = time.time()
 
@@ -384,18 +402,18 @@ class Connection(object):
         """
         self.last_active = time.time()
 
-        data = list(bytearray(self.__sock.recv(self.read_length - len(self.read_buffer))))
+        data = self.__sock.recv(self.read_length - len(self.read_buffer))
         # 断开连接
         if not data:
             callback([], self, None, None)
             return
 
-        self.read_buffer.extend(data)
+        self.read_buffer += data
         # 数据读取已经满足要求
         if len(self.read_buffer) == self.read_length:
             self.read_length, self.read_type, self.invoke_id \
-                = callback(bytearray(self.read_buffer), self, self.read_type, self.invoke_id)
-            self.read_buffer = []
+                = callback(self.read_buffer, self, self.read_type, self.invoke_id)
+            self.read_buffer = bytearray()
 
     def close(self):
         """
@@ -409,9 +427,202 @@ class Connection(object):
     def remote_host(self):
         return self.__host
 
+    def pool_key(self):
+        return self.__host, self.__index
+
     def __repr__(self):
         return self.__host
 
 
+class AsyncConnectionPool(object):
+    """
+    基于asyncio的连接池，每个远程主机一个连接，同一个连接上的多个请求通过invoke_id区分，
+    连接池只能在同一个事件循环中使用
+    """
+
+    def __init__(self):
+        # 根据远程host保存与此host相关的连接
+        self._connection_pool = {}
+        # 创建连接的锁，需要在事件循环中创建
+        self._conn_lock = None
+
+    async def aget(self, host, request_param, timeout=None):
+        """
+        执行远程调用获取数据
+        :param host:
+        :param request_param:
+        :param timeout:
+        :return:
+        """
+        conn = await self._get_connection(host)
+        request = Request(request_param)
+        invoke_id = request.invoke_id
+
+        try:
+            future = await conn.write(invoke_id, request.encode())
+            logger.debug('Waiting response, invoke_id=%s, timeout=%s, host=%s', invoke_id, timeout, host)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            err = "Socket(host='{}'): Read timed out. (read timeout={})".format(host, timeout)
+            raise DubboRequestTimeoutException(err)
+        finally:
+            conn.discard(invoke_id)
+
+    async def _get_connection(self, host):
+        """
+        通过host获取到与此host相关的连接，已经关闭的连接会被重新创建
+        :param host:
+        :return:
+        """
+        if not host or ':' not in host:
+            raise ValueError('invalid host {}'.format(host))
+        conn = self._connection_pool.get(host)
+        if conn is None or conn.closed:
+            if self._conn_lock is None:
+                self._conn_lock = asyncio.Lock()
+            async with self._conn_lock:
+                conn = self._connection_pool.get(host)
+                if conn is None or conn.closed:
+                    ip, port = host.split(':')
+                    conn = await AsyncConnection.open(ip, int(port))
+                    self._connection_pool[host] = conn
+        return conn
+
+
+class AsyncConnection(object):
+    """
+    对asyncio的StreamReader/StreamWriter做了一些封装，由一个后台task负责读取响应
+    """
+
+    def __init__(self, host, reader, writer):
+        self.__host = host
+        self.__reader = reader
+        self.__writer = writer
+        # invoke_id -> 等待响应的future
+        self.__futures = {}
+        self.closed = False
+        self.__reading_task = asyncio.ensure_future(self._read_from_server())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 5)
+        return cls('{0}:{1}'.format(host, port), reader, writer)
+
+    async def write(self, invoke_id, data):
+        """
+        向远程主机写数据
+        :param invoke_id:
+        :param data:
+        :return: 此次调用的响应所对应的future
+        """
+        if self.closed:
+            raise DubboException('{} closed.'.format(self.__host))
+        future = asyncio.get_running_loop().create_future()
+        self.__futures[invoke_id] = future
+        try:
+            self.__writer.write(data)
+            await self.__writer.drain()
+        except OSError as e:  # ConnectionError也是OSError的子类
+            # 写失败说明连接已经不可用，关闭后下次调用会重新创建连接
+            self.discard(invoke_id)
+            self.close()
+            raise DubboException('{0} write failed: {1}'.format(self.__host, e))
+        return future
+
+    def discard(self, invoke_id):
+        self.__futures.pop(invoke_id, None)
+
+    async def _read_from_server(self):
+        """
+        循环读取远程主机的响应，按照invoke_id唤醒对应的请求
+        :return:
+        """
+        try:
+            while 1:
+                head = await self.__reader.readexactly(16)
+                try:
+                    heartbeat, body_length = parse_response_head(head)
+                except DubboResponseException as e:  # 这里是dubbo的内部异常，与response中的业务异常不一样
+                    logger.exception(e)
+                    body_length = unpack('!i', head[12:])[0]
+                    invoke_id = unpack('!q', head[4:12])[0]
+                    body = await self.__reader.readexactly(body_length)
+                    error = Response(bytearray(body)).read_next()
+                    self._set_result(invoke_id, DubboResponseException('\n{}'.format(error)))
+                    continue
+
+                body = await self.__reader.readexactly(body_length)
+                if heartbeat == 2:
+                    logger.debug('❤ request  -> %s', self.__host)
+                    self.__writer.write(CLI_HEARTBEAT_RES_HEAD + head[4:12] + CLI_HEARTBEAT_TAIL)
+                elif heartbeat == 1:
+                    logger.debug('❤ response -> %s', self.__host)
+                else:
+                    invoke_id = unpack('!q', head[4:12])[0]
+                    self._set_result(invoke_id, self._parse_response(body))
+        except asyncio.IncompleteReadError:
+            logger.debug('%s closed by remote server.', self.__host)
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            self.close()
+
+    @staticmethod
+    def _parse_response(body):
+        """
+        对dubbo的响应数据进行解析
+        :param body:
+        :return: 响应的值，或者是异常
+        """
+        try:
+            res = Response(bytearray(body))
+            flag = res.read_int()
+            if flag == 2:  # 响应的值为NULL
+                return None
+            elif flag == 1:  # 正常的响应值
+                return res.read_next()
+            elif flag == 0:  # 异常的响应值
+                return BaseConnectionPool._parse_error(res)
+            else:
+                raise DubboResponseException("Unknown result flag, expect '0' '1' '2', get {}".format(flag))
+        except Exception as e:
+            logger.exception(e)
+            return e
+
+    def _set_result(self, invoke_id, result):
+        future = self.__futures.pop(invoke_id, None)
+        if future is None or future.done():
+            return
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    def close(self):
+        """
+        关闭连接，所有等待中的请求都会收到异常
+        :return:
+        """
+        if self.closed:
+            return
+        logger.debug('%s closed.', self.__host)
+        self.closed = True
+        self.__writer.close()
+        futures, self.__futures = self.__futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(DubboException('{} closed.'.format(self.__host)))
+
+    def remote_host(self):
+        return self.__host
+
+    def __repr__(self):
+        return self.__host
+
+
+# async_connection_pool在整个进程中是单例的
+async_connection_pool = AsyncConnectionPool()
+
+
 if __name__ == '__main__':
     pass
@@ -18,7 +18,18 @@
  */
 """
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
+
+try:
+    # Hessian编码的C扩展是可选的，没有安装Cython时使用纯Python实现
+    from Cython.Build import cythonize
+
+    ext_modules = cythonize([Extension('dubbo.codec._encoder_c', ['dubbo/codec/_encoder_c.pyx'])])
+    # 有Cython但没有C编译器时跳过编译，不影响安装；cythonize不会保留Extension的optional参数，因此在这里设置
+    for ext_module in ext_modules:
+        ext_module.optional = True
+except ImportError:
+    ext_modules = []
 
 setup(
     name='dubbo-python3',
@@ -29,13 +40,13 @@ setup(
     description='Python3 Dubbo Client.',
     license='Apache License 2.0',
     packages=find_packages(exclude=['tests', 'tools']),
+    ext_modules=ext_modules,
     classifiers=[
         'Environment :: Console',
         'Intended Audience :: Developers',
         'Natural Language :: Chinese (Simplified)',
         'Operating System :: OS Independent',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
@@ -43,4 +54,8 @@ setup(
     install_requires=[
         'kazoo==2.8.0'
     ],
+    extras_require={
+        # dubbo.async_client使用aiozk访问zookeeper
+        'async': ['aiozk'],
+    },
 )
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+try:
+    from aiozk import exc
+    from aiozk.recipes.children_watcher import ChildrenWatcher
+
+    from dubbo.async_client import AsyncZkRegister
+except ImportError:  # aiozk是可选依赖：pip install dubbo-python3[async]
+    AsyncZkRegister = None
+
+from dubbo.common.exceptions import RegisterException
+
+INTERFACE = '/dubbo/me.hourui.echo.provider.Echo'
+PROVIDER = 'dubbo%3A%2F%2F10.0.0.{}%3A20880%2Fme.hourui.echo.provider.Echo%3Fapplication%3Decho%26dubbo%3D2.6.1' \
+           '%26interface%3Dme.hourui.echo.provider.Echo%26methods%3Decho%26side%3Dprovider'
+CONFIGURATOR = 'override%3A%2F%2F10.0.0.{}%3A20880%2Fme.hourui.echo.provider.Echo%3Fweight%3D{}'
+
+
+class FakeZKClient(object):
+    """
+    内存中的zookeeper，只实现了AsyncZkRegister以及ChildrenWatcher用到的接口
+    """
+
+    def __init__(self, hosts):
+        self.recipes = self
+        self.nodes = {}
+        self.waiters = {}
+
+    def ChildrenWatcher(self):
+        watcher = ChildrenWatcher()
+        watcher.set_client(self)
+        return watcher
+
+    async def get_children(self, path, watch=False):
+        if path not in self.nodes:
+            raise exc.NoNode()
+        return sorted(self.nodes[path])
+
+    def wait_for_events(self, events, path):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(path, []).append(future)
+        return future
+
+    async def ensure_path(self, path):
+        pass
+
+    async def create(self, path, ephemeral=False):
+        pass
+
+    async def close(self):
+        pass
+
+    def _fire(self, path):
+        for future in self.waiters.pop(path, []):
+            if not future.done():
+                future.set_result(None)
+
+    def set_children(self, path, children):
+        parent, name = path.rsplit('/', 1)
+        if path not in self.nodes and parent in self.nodes:
+            self.nodes[parent].add(name)
+            self._fire(parent)
+        self.nodes[path] = set(children)
+        self._fire(path)
+
+    def delete(self, path):
+        parent, name = path.rsplit('/', 1)
+        del self.nodes[path]
+        self._fire(path)
+        self.nodes[parent].discard(name)
+        self._fire(parent)
+
+
+@unittest.skipIf(AsyncZkRegister is None, 'aiozk is not installed')
+class TestAsyncZkRegister(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        with mock.patch('dubbo.async_client.ZKClient', FakeZKClient):
+            self.register = AsyncZkRegister('127.0.0.1:2181')
+        self.zk = self.register.zk
+
+    async def asyncTearDown(self):
+        await self.register.close()
+
+    async def _get_host(self):
+        return await self.register.get_provider_host('me.hourui.echo.provider.Echo', None, None)
+
+    async def test_watch_providers_and_configurators(self):
+        self.zk.nodes[INTERFACE] = set()
+        self.zk.set_children(INTERFACE + '/providers', [PROVIDER.format(1)])
+        self.assertEqual('10.0.0.1:20880', await self._get_host())
+
+        self.zk.set_children(INTERFACE + '/providers', [PROVIDER.format(1), PROVIDER.format(2)])
+        await asyncio.sleep(0.05)
+        self.assertEqual(['10.0.0.1:20880', '10.0.0.2:20880'], sorted(self.register.hosts['me.hourui.echo.provider.Echo']))
+
+        # configurators节点在首次解析之后才被创建，删除后重新创建也能继续监听
+        self.zk.set_children(INTERFACE + '/configurators', [CONFIGURATOR.format(1, 0)])
+        await asyncio.sleep(0.05)
+        self.assertEqual({'10.0.0.1:20880': '0'}, self.register.weights['me.hourui.echo.provider.Echo'])
+        self.zk.delete(INTERFACE + '/configurators')
+        await asyncio.sleep(0.05)
+        self.assertEqual({}, self.register.weights['me.hourui.echo.provider.Echo'])
+        self.zk.set_children(INTERFACE + '/configurators', [CONFIGURATOR.format(2, 50)])
+        await asyncio.sleep(0.05)
+        self.assertEqual({'10.0.0.2:20880': '50'}, self.register.weights['me.hourui.echo.provider.Echo'])
+
+    async def test_missing_interface(self):
+        with self.assertRaises(RegisterException):
+            await self._get_host()
+        # interface节点出现之后可以重新解析
+        self.zk.nodes[INTERFACE] = set()
+        self.zk.set_children(INTERFACE + '/providers', [PROVIDER.format(1)])
+        self.assertEqual('10.0.0.1:20880', await self._get_host())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import asyncio
+import re
+import unittest
+from struct import pack, unpack
+
+from dubbo.common.constants import CLI_HEARTBEAT_RES_HEAD, CLI_HEARTBEAT_TAIL
+from dubbo.common.exceptions import DubboRequestTimeoutException
+from dubbo.connection.connections import AsyncConnectionPool
+
+HEARTBEAT_ID = b'\x00\x00\x00\x00\x00\x00\x30\x39'
+
+
+class FakeProvider(object):
+    """
+    基于asyncio.start_server的dubbo服务端，把请求中的req-N原样返回
+    """
+
+    def __init__(self, batch=1, close_after=None, heartbeat=False):
+        """
+        :param batch: 攒够batch个请求后再以相反的顺序响应，用于验证按照invoke_id分发响应
+        :param close_after: 响应了这么多个请求后主动关闭连接
+        :param heartbeat: 每个请求之前先向客户端发送一个心跳请求
+        """
+        self.batch = batch
+        self.close_after = close_after
+        self.heartbeat = heartbeat
+        self.connections = 0
+        self.heartbeat_replies = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return '127.0.0.1:{}'.format(self.server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        pending, answered = [], 0
+        try:
+            while 1:
+                head = await reader.readexactly(16)
+                body = await reader.readexactly(unpack('!i', head[12:])[0])
+                if head[2] & 0x20:  # 客户端对心跳的响应
+                    self.heartbeat_replies.append(head + body)
+                    continue
+                if self.heartbeat:
+                    writer.write(b'\xda\xbb\xe2\x00' + HEARTBEAT_ID + pack('!i', 1) + b'N')
+                token = re.search(rb'req-\d+', body)
+                if token is None:  # 不响应，用于验证超时
+                    continue
+                pending.append((head[4:12], token.group()))
+                if len(pending) < self.batch:
+                    continue
+                for invoke_id, value in reversed(pending):
+                    res = b'\x91' + bytes([len(value)]) + value
+                    writer.write(b'\xda\xbb\x02\x14' + invoke_id + pack('!i', len(res)) + res)
+                answered += len(pending)
+                pending = []
+                await writer.drain()
+                if self.close_after is not None and answered >= self.close_after:
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+
+def request_param(value):
+    return {'dubbo_version': '2.6.1', 'path': 'me.hourui.echo.provider.Echo', 'method': 'echo1', 'arguments': [value]}
+
+
+class TestAsyncConnectionPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = AsyncConnectionPool()
+        self.provider = None
+
+    async def asyncTearDown(self):
+        for conn in self.pool._connection_pool.values():
+            conn.close()
+        await asyncio.sleep(0.05)  # 等待服务端处理完连接的关闭
+        await self.provider.stop()
+
+    async def _start(self, provider):
+        self.provider = provider
+        return await provider.start()
+
+    async def _call(self, host, value, timeout=2):
+        return await self.pool.aget(host, request_param(value), timeout)
+
+    async def test_route_by_invoke_id(self):
+        provider = FakeProvider(batch=5)
+        host = await self._start(provider)
+        values = ['req-{}'.format(i) for i in range(5)]
+        self.assertEqual(values, list(await asyncio.gather(*[self._call(host, value) for value in values])))
+        self.assertEqual(1, provider.connections)
+
+    async def test_timeout(self):
+        provider = FakeProvider()
+        host = await self._start(provider)
+        with self.assertRaises(DubboRequestTimeoutException):
+            await self._call(host, 'no-reply', timeout=0.2)
+        # 超时之后连接仍然可用
+        self.assertEqual('req-1', await self._call(host, 'req-1'))
+
+    async def test_reconnect_after_remote_close(self):
+        provider = FakeProvider(close_after=1)
+        host = await self._start(provider)
+        self.assertEqual('req-1', await self._call(host, 'req-1'))
+        await asyncio.sleep(0.1)  # 等待读取任务发现连接已被关闭
+        self.assertEqual('req-2', await self._call(host, 'req-2'))
+        self.assertEqual(2, provider.connections)
+
+    async def test_heartbeat_reply(self):
+        provider = FakeProvider(heartbeat=True)
+        host = await self._start(provider)
+        self.assertEqual('req-1', await self._call(host, 'req-1'))
+        await asyncio.sleep(0.1)
+        self.assertEqual([CLI_HEARTBEAT_RES_HEAD + HEARTBEAT_ID + CLI_HEARTBEAT_TAIL], provider.heartbeat_replies)
+
+
+if __name__ == '__main__':
+    unittest.main()
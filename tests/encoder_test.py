@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import unittest
+
+from dubbo.codec import encoder
+from dubbo.codec.encoder import Request
+
+
+class TestEncodeStr(unittest.TestCase):
+    """
+    字符串编码的字节必须与Java的Hessian2Output#printString保持一致
+    """
+
+    def test_ascii(self):
+        self.assertEqual(b'\x05hello', Request._encode_str('hello'))
+
+    def test_bmp(self):
+        # 长度为Java中char的个数，内容为utf-8编码
+        self.assertEqual(b'\x02\xe4\xb8\xad\xe6\x96\x87', Request._encode_str('中文'))
+
+    def test_emoji(self):
+        # BMP以外的字符拆分为两个代理字符，每个代理字符单独编码为3个字节（CESU-8）
+        self.assertEqual(b'\x02\xed\xa0\xbd\xed\xb0\xb6', Request._encode_str('🐶'))
+        self.assertEqual(b'\x04a\xed\xa0\xbd\xed\xb0\xb6\xe4\xb8\xad', Request._encode_str('a🐶中'))
+
+    def test_long(self):
+        value = '中' * 0x20
+        self.assertEqual(b'\x30\x20' + value.encode('utf-8'), Request._encode_str(value))
+        value = '🐶' * 0x200
+        self.assertEqual(b'S\x04\x00' + b'\xed\xa0\xbd\xed\xb0\xb6' * 0x200, Request._encode_str(value))
+
+
+
+@unittest.skipIf(encoder._encoder_c is None, 'C extension is not built')
+class TestEncoderExtension(unittest.TestCase):
+    """
+    C扩展会替换纯Python的数值编码，两者在各个编码区间的边界上输出必须完全一致
+    """
+
+    def assertSameEncoding(self, py_encode, c_encode, values):
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(py_encode(value), c_encode(value))
+
+    def test_int(self):
+        values = []
+        for bound in (0x10, 0x2f, 0x800, 0x7ff, 0x40000, 0x3ffff, 2 ** 31, 2 ** 63 - 1):
+            for value in (bound - 1, bound, bound + 1):
+                values += [value, -value]
+        values = [value for value in values if -2 ** 63 <= value < 2 ** 63] + [-2 ** 63]
+        self.assertSameEncoding(encoder._py_encode_int, encoder._encoder_c.encode_int, values)
+        self.assertSameEncoding(encoder._py_encode_long, encoder._encoder_c.encode_long, values)
+
+    def test_float(self):
+        values = [0.0, -0.0, 1.0, -1.0, 0.5, 0.001, -0.001, 1.0001, 1e-300, 1e300, 3.14159265358979]
+        for bound in (0x80, 0x8000):
+            for value in (bound - 1, bound, bound + 1):
+                values += [float(value), -float(value)]
+        # 以毫秒编码的数值在int32边界上的情况
+        for mills in (2 ** 31 - 2, 2 ** 31 - 1, 2 ** 31, 2 ** 31 + 1):
+            values += [mills / 1000, -mills / 1000]
+        self.assertSameEncoding(encoder._py_encode_float, encoder._encoder_c.encode_float, values)
+
+        for value in (float('inf'), float('-inf'), float('nan')):
+            with self.subTest(value=value):
+                with self.assertRaises(Exception) as py_error:
+                    encoder._py_encode_float(value)
+                with self.assertRaises(type(py_error.exception)):
+                    encoder._encoder_c.encode_float(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
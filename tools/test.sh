@@ -4,5 +4,8 @@ basedir=$(dirname "$0")
 cd "${basedir}/.."
 echo -e "\033[33m${PWD}\033[0m"
 
+python -m unittest tests.encoder_test
+python -m unittest tests.connection_test
+python -m unittest tests.async_client_test
 python -m unittest tests.dubbo_test
 python -m unittest tests.run_test